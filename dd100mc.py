@@ -44,214 +44,140 @@ W<n>        - Selects the wavelength using <n>.
     This command is valid only when the unit is calibrated for more than one wavelength.
 
 """
-import dataclasses
-import enum
+import contextlib
 import errno
+import select
 import time
 import socket
-from typing import Union, Dict, Tuple
+import threading
+from concurrent.futures import Future
+from typing import Union, Tuple, Optional, List
 
 from hardware_device_base import HardwareMotionBase
 
-class ResponseType(enum.Enum):
-    """Controller response types."""
-    ATTEN = "attenuation"
-    POS = "steps"
-    DIFF = "diff"
-    BOTH = "attenuation and steps"
-    STRING = "string"
-    ERROR = "error"
+from dd100mc_common import (OZProtocolMixin, OzResponse, ResponseType, configure_socket,
+                            encode_cmd)
 
 
-@dataclasses.dataclass
-class OzResponse:
-    """Oz controller response data."""
-    type: ResponseType
-    value: Union[float, int, str, dict, None]
-
-
-class OZController(HardwareMotionBase):
+class OZController(OZProtocolMixin, HardwareMotionBase):
     """
     Controller class for OZ Optics DD-100-MC Attenuator Controller.
+
+    Each command holds the controller lock from send until its reply is read,
+    so only one command is in flight at a time; use pipeline() to batch.
     """
-    # pylint: disable=too-many-instance-attributes
-
-    controller_commands = ["A",     # Set attenuation
-                           "A?",    # Get attenuation
-                           "B",     # Move attenuator one step backward
-                           "CD",    # Configuration Display
-                           "D",     # Gets current attenuation and step position
-                           "E0",    # In RS232 mode, sets echo to OFF
-                           "E1",    # In RS232 mode, sets echo to ON
-                           "F",     # Move attenuator one step forward
-                           "H",     # Re-homes the unit
-                           "L",     # Insertion loss
-                           "RES?",  # Read previous command response
-                           "RST",   # Restarts in self-test mode
-                           "S?",    # Requests current position of the attenuator
-                           "S",     # Sets the position of the attenuator to <n> steps from home
-                           "S+",    # Adds <n> steps to current position
-                           "S-"     # Subtracts <n> steps from current position
-                           ]
-    return_value_commands = ["A", "A?", "B", "CD", "D", "F", "H", "L",
-                             "RES?", "RST", "S?", "S", "S+", "S-" ]
-    parameter_commands = ["A", "L", "S", "S+", "S-"]
-    error = {
-        "Done": "No error.",
-        "Error-2": "Bad command.  The command is ignored.",
-        "Error-5": "Home sensor error.  Return unit to factory for repair.",
-        "Error-6": "Overflow.  The command is ignored.",
-        "Error-7": "Motor voltage exceeds safe limits"
-    }
+    # pylint: disable=too-many-instance-attributes,too-many-public-methods
+
+    # Maximum seconds to wait after each send for the controller firmware, 0 to disable
+    post_send_settle_s = .05
 
     def __init__(self, log: bool =True, logfile: str =__name__.rsplit(".", 1)[-1],
-                 init_atten: float | None =None):
+                 init_atten: float | None =None, single_thread: bool =False):
 
         """
         Class to handle communications with the stage controller and any faults
 
         :param log: Boolean, whether to log to file or not
         :param logfile: Filename for log
+        :param init_atten: Float, attenuation to set in initialize(), or None
+        :param single_thread: Boolean, if true, the controller is only used from
+            one thread and socket access is not locked
 
         NOTE: default is INFO level logging, use set_verbose to increase verbosity.
         """
-        super().__init__(log, logfile)
+        super().__init__(log, logfile, init_atten=init_atten)
 
         # Set up socket
         self.socket = None
+        self._quickack = False
+        self._lock = contextlib.nullcontext() if single_thread else self.lock
 
-        self.current_attenuation = None
-        self.init_attenuation = init_atten
-        self.current_position = None
-        self.current_diff = None
-        self.configuration = ""
-        self.homed = False
-        self.last_error = ""
+        # Send time of the last command and running average of reply times
+        self._sent_at = None
+        self._resp_ewma = self.post_send_settle_s
 
-    def _clear_socket(self):
-        """ Clear socket buffer. """
-        if self.socket is not None:
-            self.socket.setblocking(False)
-            while True:
-                try:
-                    _ = self.socket.recv(1024)
-                except BlockingIOError:
-                    break
-            self.socket.setblocking(True)
-
-    def _read_reply(self) -> Union[OzResponse, None]:
-        """Read the return message from stage controller."""
-        # Get return value
-        recv = self.socket.recv(2048)
-
-        # Did we get the entire return?
-        tries = 5
-        while tries > 0 and b'Done' not in recv:
-            recv += self.socket.recv(2048)
-            if b'Error' in recv:
-                self.report_error(recv.decode('utf-8'))
-                error_string = self._return_parse_error(str(recv.decode('utf-8')))
-                return OzResponse(ResponseType.ERROR, error_string)
-            tries -= 1
-
-        recv_len = len(recv)
-        self.report_debug(f"Return: len = {recv_len}, Value = {recv}")
-
-        if b'Done' not in recv:
-            msg_data = str(recv.decode('utf-8'))
-            self.report_error(f"Read from controller timed out: {msg_data}")
-            return None
+        # Commands queued while a pipeline is open, kept per thread so one
+        # thread's pipeline neither blocks nor swallows another's commands
+        self._pipeline_state = threading.local()
 
-        resp = self._parse_response(str(recv.decode('utf-8', errors='ignore')))
-        if resp.type == ResponseType.ERROR:
-            self.report_error(resp.value)
+    @property
+    def _pipeline_buf(self) -> Optional[bytearray]:
+        """ Encoded commands queued in this thread's open pipeline, or None """
+        return getattr(self._pipeline_state, "buf", None)
 
-        return resp
+    @_pipeline_buf.setter
+    def _pipeline_buf(self, value: Optional[bytearray]):
+        self._pipeline_state.buf = value
 
-    def _parse_response(self, raw: str) -> OzResponse:
-        """Parse the response from stage controller."""
-        # pylint: disable=too-many-branches,too-many-statements
-        raw = raw.strip()
+    @property
+    def _pipeline_futures(self) -> List[Future]:
+        """ Futures for the commands queued in this thread's pipeline """
+        return getattr(self._pipeline_state, "futures", [])
 
-        if 'Pos:' in raw:
-            try:
-                pos = int(raw.split('Pos:')[1].split()[0])
-                self.current_position = pos
-                pos_read = True
-            except ValueError:
-                self.report_error("Error parsing position")
-                pos = None
-                pos_read = False
-        else:
-            pos = None
-            pos_read = False
+    @_pipeline_futures.setter
+    def _pipeline_futures(self, value: List[Future]):
+        self._pipeline_state.futures = value
 
-        if 'Atten:' in raw:
-            try:
-                if 'unknown' in raw:
-                    atten = None
-                else:
-                    atten = float(raw.split('Atten:')[1].split('(')[0])
-                self.current_attenuation = atten
-                atten_read = True
-            except ValueError:
-                self.report_error("Error parsing attenuation")
-                atten = None
-                atten_read = False
-        elif 'ATTEN:' in raw:
-            try:
-                if 'unknown' in raw:
-                    atten = None
-                else:
-                    atten = float(raw.split('ATTEN:')[1])
-                self.current_attenuation = atten
-                atten_read = True
-            except ValueError:
-                self.report_error("Error parsing ATTENuation")
-                atten = None
-                atten_read = False
-        else:
-            atten = None
-            atten_read = False
-
-        # Diff (after homing)
-        if 'Diff=' in raw:
-            try:
-                diff = float(raw.split('Diff=')[1].split()[0])
-                self.current_diff = diff
-                self.current_position = 0
-                diff_read = True
-            except ValueError:
-                self.report_error("Error parsing diff")
-                diff = None
-                diff_read = False
-        else:
-            diff = None
-            diff_read = False
+    def _clear_socket(self):
+        """ Clear socket buffer. """
+        if self.socket is not None:
+            # Only recv while data is pending, leaving the blocking mode alone;
+            # stale bytes land in the receive buffer, which is being discarded
+            while select.select([self.socket], [], [], 0)[0]:
+                if not self.socket.recv_into(self._rx_buf):
+                    break
+        self._rx_len = 0
 
-        # Error cases
-        if 'Error' in raw or self.status < 0:
-            error_string = raw if self.status >= 0 else self.status_string
-            return OzResponse(ResponseType.ERROR, error_string)
+    def _read_until_done(self, timeout: float = OZProtocolMixin.reply_timeout_s
+                         ) -> Union[Tuple[bytes, bool], None]:
+        """Read up to and including the next reply terminator.
 
-        # Both Attenuation and Steps
-        if pos_read and atten_read:
-            return OzResponse(ResponseType.BOTH, {"pos": pos, "atten": atten})
+        Anything received after the terminator is kept for the next call,
+        so pipelined replies are consumed one at a time.
 
-        # Attenuation
-        if atten_read:
-            return OzResponse(ResponseType.ATTEN, atten)
+        :param timeout: Float, seconds to wait for the complete reply
+        :return: (reply bytes, True if the reply ended with an error code),
+            or None on timeout
+        """
+        # Wait for data to arrive rather than blocking in recv
+        end = self._reply_end.search(self._rx_buf, 0, self._rx_len)
+        deadline = time.monotonic() + timeout
+        while end is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([self.socket], [], [], remaining)[0]:
+                break
+            # Only rescan the tail a split terminator could start in
+            scanned = max(0, self._rx_len - 6)
+            # Double the buffer when full, then receive straight into its free tail
+            if self._rx_len == len(self._rx_buf):
+                self._rx_buf += bytes(len(self._rx_buf))
+            nbytes = self.socket.recv_into(memoryview(self._rx_buf)[self._rx_len:])
+            if not nbytes:
+                break
+            self._rx_len += nbytes
+            # Linux clears quick-ack after each ACK, so re-arm it per read
+            if self._quickack:
+                self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+            end = self._reply_end.search(self._rx_buf, scanned, self._rx_len)
+
+        if end is None:
+            msg_data = self._decode(self._rx_buf[:self._rx_len])
+            self._rx_len = 0
+            self.report_error(f"Read from controller timed out: {msg_data}")
+            return None
 
-        # Pos
-        if pos_read:
-            return OzResponse(ResponseType.POS, pos)
+        return self._take_reply(end)
 
-        # Diff (after homing)
-        if diff_read:
-            return OzResponse(ResponseType.DIFF, diff)
+    def _read_reply(self, timeout: float = OZProtocolMixin.reply_timeout_s
+                    ) -> Union[OzResponse, None]:
+        """Read and parse the next return message from stage controller.
 
-        # Default to string
-        return OzResponse(ResponseType.STRING, raw)
+        :param timeout: Float, seconds to wait for the complete reply
+        """
+        reply = self._read_until_done(timeout)
+        if reply is None:
+            return None
+        return self._handle_reply(*reply)
 
     def _send_serial_command(self, cmd='') -> bool:
         """
@@ -267,15 +193,28 @@ class OZController(HardwareMotionBase):
             return False
 
         # Prep command
-        cmd_send = f"{cmd}\r\n"
-        self.report_debug(f"Sending command: {cmd_send}")
-        cmd_encoded = cmd_send.encode('utf-8')
+        if self._debug:
+            self.report_debug(f"Sending command: {cmd}")
+        try:
+            cmd_encoded = encode_cmd(cmd)
+        except UnicodeEncodeError:
+            self.report_error(f"Command is not ASCII: {cmd}")
+            return False
+
+        # Queue command while pipelining
+        if self._pipeline_buf is not None:
+            self._pipeline_buf.extend(cmd_encoded)
+            return True
 
         try:
-            self.socket.settimeout(30)
             # Send command
-            self.socket.send(cmd_encoded)
-            time.sleep(.05)
+            self.socket.sendall(cmd_encoded)
+            self._sent_at = time.monotonic()
+            # Settle in proportion to how fast the controller has been replying,
+            # but stop waiting as soon as the reply starts to arrive
+            settle = min(self.post_send_settle_s, 0.2 * self._resp_ewma)
+            if settle > 0:
+                select.select([self.socket], [], [], settle)
             return True
 
         except socket.error as ex:
@@ -290,62 +229,130 @@ class OZController(HardwareMotionBase):
         :param command: String, command to send to the stage controller
         :param *args: List of string parameters associated with cmd
         :param custom_command: Boolean, if true, command is custom
-        :return: dictionary {'data|error': string_message}
+        :return: True if the command was sent, False otherwise
         """
-
-        # verify cmd and stage_id
-        if not self._verify_send_command(command, custom_command):
+        command = self._build_command(command, *args, custom_command=custom_command)
+        if command is None:
             return False
 
-        # Check if the command should have parameters
-        if command in self.parameter_commands and args:
-            self.report_debug("Adding parameters")
-            parameters = [str(x) for x in args]
-            parameters = "".join(parameters)
-            command += parameters
-
-        self.report_debug(f"Input command: {command}")
-
         # Send serial command
-        with self.lock:
+        with self._lock:
             result = self._send_serial_command(command)
 
         return result
 
-    def _verify_send_command(self, cmd, custom_command=False) -> bool:
-        """ Verify cmd and stage_id
+    def _exchange(self, command: str, *args,
+                  timeout: float = OZProtocolMixin.reply_timeout_s) -> Union[OzResponse, None]:
+        """
+        Send a command and read its reply under a single lock
 
-        :param cmd: String, command to send to the stage controller
-        :param custom_command: Boolean, if true, command is custom
-        :return: dictionary {'data|error': string_message}"""
+        Holding the lock for the whole exchange keeps another thread's
+        command from being interleaved between the send and the read.
 
-        # Do we have a connection?
-        if not self.is_connected():
-            self.report_error('Not connected to controller')
-            return False
+        :param command: String, command to send to the stage controller
+        :param *args: List of string parameters associated with cmd
+        :param timeout: Float, seconds to wait for the reply
+        :return: OzResponse, or None if the command was not sent or timed out
+        """
+        if self._pipeline_buf is not None:
+            self.report_error("Use queue_command() while a pipeline is open")
+            return None
+
+        command = self._build_command(command, *args)
+        if command is None:
+            return None
+
+        with self._lock:
+            if not self._send_serial_command(command):
+                return None
+            resp = self._read_reply(timeout)
+            # Only single round trips feed the average; a pipelined reply's
+            # wait includes every reply queued ahead of it
+            if resp is not None:
+                elapsed = time.monotonic() - self._sent_at
+                self._resp_ewma = 0.9 * self._resp_ewma + 0.1 * elapsed
+            return resp
+
+    def _execute_pipeline(self) -> bool:
+        """
+        Send all queued commands in a single write, then read their replies
+
+        Replies are matched to the queued futures in FIFO order.
+
+        :return: True if the commands were sent, False otherwise
+        """
+        cmd_buf = self._pipeline_buf
+        futures = self._pipeline_futures
+        self._pipeline_buf = None
+        self._pipeline_futures = []
 
-        # Do we have a legal command?
-        if cmd.rstrip().upper() in self.controller_commands:
-            self.report_info(f"{cmd} is a valid command")
+        if not futures:
             return True
-        if not custom_command:
-            self.report_error(f"{cmd} is not a valid command")
-            return False
-        self.report_info(f"{cmd} is a custom command")
+
+        with self._lock:
+            try:
+                self.socket.sendall(cmd_buf)
+            except socket.error as ex:
+                self.report_error(f"Pipeline send error: {ex.strerror}")
+                for fut in futures:
+                    fut.set_result(None)
+                return False
+
+            for fut in futures:
+                fut.set_result(self._read_reply())
         return True
 
-    def _return_parse_error(self, error=""):
+    # --- User-Facing Methods
+    @contextlib.contextmanager
+    def pipeline(self):
         """
-        Parse the return error message from the controller.  The message code is
-        given in the last string character
+        Queue commands and send them to the controller in a single write.
 
-        :param error: Error code from the controller
-        :return: String message
+        Use queue_command() inside the block; the returned futures are
+        resolved with each command's OzResponse (or None) when the block exits.
+        If the block raises, nothing queued is sent and the futures resolve
+        to None.
+
+        with controller.pipeline():
+            pos = controller.queue_command("S?")
+            atten = controller.queue_command("A?")
+        print(pos.result(), atten.result())
         """
-        error = error.rstrip()
-        return self.error.get(error, "Unknown error")
+        # Nested blocks join the pipeline that is already open
+        if self._pipeline_buf is not None:
+            yield self
+            return
+        self._pipeline_buf = bytearray()
+        self._pipeline_futures = []
+        try:
+            yield self
+        except BaseException:
+            # Never move the stage for a batch that was abandoned part way
+            futures = self._pipeline_futures
+            self._pipeline_buf = None
+            self._pipeline_futures = []
+            for fut in futures:
+                fut.set_result(None)
+            raise
+        self._execute_pipeline()
+
+    def queue_command(self, command: str, *args) -> Union[Future, None]:
+        """
+        Queue a command in the open pipeline
+
+        :param command: String, command to send to the stage controller
+        :param *args: List of parameters associated with command
+        :return: Future resolved with the command's OzResponse, or None on error
+        """
+        if self._pipeline_buf is None:
+            self.report_error("No pipeline open, use pipeline()")
+            return None
+        if not self._send_command(command, *args):
+            return None
+        fut = Future()
+        self._pipeline_futures.append(fut)
+        return fut
 
-    # --- User-Facing Methods
     def connect(self, host, port,  con_type: str="tcp") -> None:  # pylint: disable=W0221
         """ Connect to stage controller.
 
@@ -369,9 +376,16 @@ class OZController(HardwareMotionBase):
                     else:
                         self.report_error(f"Connection error: {ex.strerror}")
                         self._set_connected(False)
-                # clear socket
+                # configure and clear socket
                 if self.is_connected():
-                    self._clear_socket()
+                    with self._lock:
+                        self.socket.settimeout(self.reply_timeout_s)
+                        configure_socket(self.socket)
+                        # Quick-ack from the first reply on; reads re-arm it
+                        self._quickack = hasattr(socket, "TCP_QUICKACK")
+                        if self._quickack:
+                            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+                        self._clear_socket()
             elif con_type == "serial":
                 self.report_error("Serial connection not implemented")
                 self._set_connected(False)
@@ -389,9 +403,10 @@ class OZController(HardwareMotionBase):
             return
         try:
             self.report_info("Disconnecting from stage controller")
-            self.socket.shutdown(socket.SHUT_RDWR)
-            self.socket.close()
-            self.socket = None
+            with self._lock:
+                self.socket.shutdown(socket.SHUT_RDWR)
+                self.socket.close()
+                self.socket = None
             self._set_connected(False)
             self.report_info("Disconnected from stage controller")
         except OSError as ex:
@@ -406,24 +421,14 @@ class OZController(HardwareMotionBase):
         :return: True if home was successful, False otherwise
         """
         if not self.is_homed():
-            if self._send_command('H'):
-                self.current_attenuation = None
-                self.current_position = None
-                resp = self._read_reply()
-                if resp.type == ResponseType.DIFF:
-                    self.homed = True
-                    self.report_debug(f"{resp.value}")
-                elif resp.type == ResponseType.ERROR:
-                    self.report_error(f"{resp.value}")
+            self.current_attenuation = None
+            self.current_position = None
+            self._record_home(self._exchange('H'))
         else:
             self.report_warning("Already homed.")
 
         return self.homed
 
-    def is_homed(self) -> bool:
-        """ Has the stage controller been homed?"""
-        return self.homed
-
     def get_atomic_value(self, item: str ="") -> Union[float, int, str, None]:
         """Return single value for item"""
         if "pos" in item:
@@ -453,28 +458,16 @@ class OZController(HardwareMotionBase):
         :return: True if successful, False otherwise
         """
         # check attenuation limits
-        if atten is None or atten < 0.0 or atten > 60.0:
-            self.report_error(f"Invalid attenuation: {atten}, cannot be < 0. or > 60.")
+        if not self._valid_attenuation(atten):
             return False
 
         # Send move to controller
-        if self._send_command("A", atten):
-            resp = self._read_reply()
-            if resp.type == ResponseType.POS:
-                time.sleep(0.5)
-                cur_atten = self.get_attenuation()
-                self.report_debug(f"{cur_atten}")
-                if cur_atten != atten:
-                    self.report_error("Attenuation setting not achieved!")
-                    return False
-                return True
-            if resp.type == ResponseType.ERROR:
-                self.report_error(f"{resp.value}")
-            else:
-                self.report_error("Attenuation setting not achieved!")
+        resp = self._exchange("A", atten)
+        if not self._move_started(resp, "Attenuation setting not achieved!"):
             return False
-        self.report_error("Attenuation setting not achieved!")
-        return False
+        time.sleep(0.5)
+        return self._value_reached(self.get_attenuation(), round(atten, 2),
+                                   "Attenuation setting not achieved!")
 
     def set_pos(self, pos=None):  # pylint: disable=W0221
         """
@@ -485,24 +478,14 @@ class OZController(HardwareMotionBase):
         """
 
         # Send move to controller
-        if self._send_command("S", pos):
-            resp = self._read_reply()
-            if resp.type == ResponseType.POS:
-                time.sleep(0.5)
-                cur_pos = resp.value
-                self.report_debug(f"{cur_pos}")
-                if cur_pos != pos:
-                    self.report_error("Position setting not achieved!")
-                    return False
-                self.get_attenuation()
-                return True
-            if resp.type == ResponseType.ERROR:
-                self.report_error(f"{resp.value}")
-            else:
-                self.report_error("Position setting not achieved!")
+        resp = self._exchange("S", pos)
+        if not self._move_started(resp, "Position setting not achieved!"):
             return False
-        self.report_error("Position setting not achieved!")
-        return False
+        time.sleep(0.5)
+        if not self._value_reached(resp.value, pos, "Position setting not achieved!"):
+            return False
+        self.get_attenuation()
+        return True
 
     def step(self, direction:str = 'F') -> Union[int, None]:
         """
@@ -510,28 +493,33 @@ class OZController(HardwareMotionBase):
         :param direction: String, 'F' - forward or 'B' - backward
         :return: Current position in steps or None
         """
-        direc = direction.upper()
-        # check inputs
-        if direc not in ['F', 'B']:
-            self.report_error("Invalid direction: use F or B")
+        direc = self._step_direction(direction)
+        if direc is None:
             return None
+        return self._move(direc)
 
-        if self._send_command(direc):
-            resp = self._read_reply()
-            if resp.type == ResponseType.POS:
-                self.report_debug(f"{resp.value}")
-                cur_pos = resp.value
-                if cur_pos != self.current_position:
-                    self.report_error("Position setting not achieved!")
-                    self.current_position = cur_pos
-                return cur_pos
-            if resp.type == ResponseType.ERROR:
-                self.report_error(f"{resp.value}")
-            else:
-                self.report_error("Position setting not achieved!")
+    def step_many(self, nsteps: int) -> Union[int, None]:
+        """
+        Move stage by a relative number of steps with a single command,
+        rather than calling step() once per step
+        :param nsteps: Int, steps to move, positive forward or negative backward
+        :return: Current position in steps or None
+        """
+        move = self._step_command(nsteps)
+        if move is None:
             return None
-        self.report_error("Position setting not achieved!")
-        return None
+        return self._move(*move)
+
+    def _move(self, command: str, *args) -> Union[int, None]:
+        """
+        Send a relative move and check the reported position
+
+        :param command: String, F, B, S+ or S-
+        :param *args: Step count for S+ and S-
+        :return: Current position in steps or None
+        """
+        target = self._move_target(command, *args)
+        return self._moved_to(self._exchange(command, *args), target)
 
     def get_pos(self) -> Union[int, None]:  # pylint: disable=W0221
         """ Current position
@@ -539,15 +527,7 @@ class OZController(HardwareMotionBase):
         :return: current position in steps or None
         """
 
-        if self._send_command("S?"):
-            resp = self._read_reply()
-            if resp.type == ResponseType.POS:
-                self.report_debug(f"{resp.value}")
-                return resp.value
-            if resp.type == ResponseType.ERROR:
-                self.report_error(f"{resp.value}")
-            return None
-        return None
+        return self._reply_value(self._exchange("S?"), ResponseType.POS)
 
     def get_attenuation(self) -> Union[float, None]:
         """ Current attenuation
@@ -555,15 +535,7 @@ class OZController(HardwareMotionBase):
         :return: dictionary {'data|error': current_attenuation|string_message}
         """
 
-        if self._send_command("A?"):
-            resp = self._read_reply()
-            if resp.type == ResponseType.ATTEN:
-                self.report_debug(f"{resp.value}")
-                return resp.value
-            if resp.type == ResponseType.ERROR:
-                self.report_error(f"{resp.value}")
-            return None
-        return None
+        return self._reply_value(self._exchange("A?"), ResponseType.ATTEN)
 
     def reset(self):
         """ Reset stage
@@ -571,17 +543,10 @@ class OZController(HardwareMotionBase):
         :return: Configuration string
         """
 
-        if self._send_command("RST"):
-            time.sleep(2.)
-            resp = self._read_reply()
-            if resp.type == ResponseType.STRING:
-                self.report_debug(f"{resp.value}")
-                return resp.value
-            if resp.type == ResponseType.ERROR:
-                self.report_error(f"{resp.value}")
-            return None
-        self.report_error("Failed to reset stage")
-        return None
+        # The reply arrives once the self-test finishes, so wait for it
+        # instead of sleeping a fixed time first
+        return self._reply_value(self._exchange("RST"), ResponseType.STRING,
+                                 "Failed to reset stage")
 
     def get_params(self) -> Union[str, None]:
         """ Get stage parameters
@@ -589,17 +554,11 @@ class OZController(HardwareMotionBase):
         :return: return from __send_command
         """
 
-        if self._send_command("CD"):
-            resp = self._read_reply()
-            if resp.type == ResponseType.STRING:
-                self.report_debug(f"{resp.value}")
-                self.configuration = resp.value
-                return resp.value
-            if resp.type == ResponseType.ERROR:
-                self.report_error(f"{resp.value}")
-            return None
-        self.report_error("Failed to get stage parameters")
-        return None
+        params = self._reply_value(self._exchange("CD"), ResponseType.STRING,
+                                   "Failed to get stage parameters")
+        if params is not None:
+            self.configuration = params
+        return params
 
     def initialize(self) -> bool:
         """ Initialize stage controller. """
@@ -617,17 +576,20 @@ class OZController(HardwareMotionBase):
         self.initialized = self.homed
         return self.homed
 
-    def read_from_controller(self) -> str:
-        """ Read from controller"""
-        self.socket.setblocking(False)
-        try:
-            recv = self.socket.recv(2048)
-            recv_len = len(recv)
-            self.report_debug(f"Return: len = {recv_len}, Value = {recv}")
-        except BlockingIOError:
-            recv = b""
-        self.socket.setblocking(True)
-        return str(recv.decode('utf-8'))
+    def read_from_controller(self, timeout: float = 0.) -> str:
+        """ Read from controller
+
+        :param timeout: Float, seconds to wait for data to arrive
+        """
+        # Start with anything left over from the last framed reply
+        recv = bytes(self._rx_buf[:self._rx_len])
+        self._rx_len = 0
+        if select.select([self.socket], [], [], timeout)[0]:
+            recv += self.socket.recv(65536)
+            if self._debug:
+                recv_len = len(recv)
+                self.report_debug(f"Return: len = {recv_len}, Value = {recv}")
+        return self._decode(recv)
 
     def run_manually(self):
         """ Input stage commands manually
@@ -635,6 +597,14 @@ class OZController(HardwareMotionBase):
         :return: None
         """
 
+        # Read-only queries go through their methods so replies are parsed
+        # and cached state updated; anything that moves the stage is sent as typed
+        dispatch = {
+            "S?": self.get_pos,
+            "A?": self.get_attenuation,
+            "CD": self.get_params,
+        }
+
         while True:
 
             cmd = input("Enter Command")
@@ -642,20 +612,11 @@ class OZController(HardwareMotionBase):
             if not cmd:
                 break
 
-            if self._send_command(cmd, custom_command=True):
-                output = self.read_from_controller()
+            handler = dispatch.get(cmd.strip().upper())
+            if handler is not None:
+                self.report_info(f"{handler()}")
+            elif self._send_command(cmd, custom_command=True):
+                output = self.read_from_controller(timeout=1.)
                 self.report_info(output)
             else:
                 self.report_error(f"Error sending command {cmd}")
-
-    def close_loop(self) -> bool:
-        """ Close loop"""
-        return True
-
-    def is_loop_closed(self) -> bool:
-        """ Check if loop is closed"""
-        return True
-
-    def get_limits(self) -> Union[Dict[str, Tuple[float, float]], None]:
-        """ Get stage limits"""
-        return None
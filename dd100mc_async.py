@@ -0,0 +1,288 @@
+# coding=utf-8
+"""
+asyncio controller for the OZ Optics DD-100-MC attenuator.
+
+Every round trip is a coroutine on an asyncio stream, so one event loop can
+drive many attenuators without a thread per controller.  Commands, replies
+and parsing are shared with the blocking dd100mc.OZController.
+"""
+import asyncio
+from typing import Union, Tuple, Optional
+
+from hardware_device_base import HardwareMotionBase
+
+from dd100mc_common import (OZProtocolMixin, OzResponse, ResponseType, configure_socket,
+                            encode_cmd)
+
+
+class AsyncOZController(OZProtocolMixin, HardwareMotionBase):
+    """
+    asyncio controller class for OZ Optics DD-100-MC Attenuator Controller.
+
+    One command is in flight per controller; concurrent tasks wait their turn.
+    """
+    # HardwareMotionBase's motion interface is implemented as coroutines here
+    # pylint: disable=invalid-overridden-method,too-many-public-methods
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, log: bool =True, logfile: str =__name__.rsplit(".", 1)[-1],
+                 init_atten: float | None =None):
+        """
+        Class to handle communications with the stage controller and any faults
+
+        :param log: Boolean, whether to log to file or not
+        :param logfile: Filename for log
+        :param init_atten: Float, attenuation to set in initialize(), or None
+
+        NOTE: default is INFO level logging, use set_verbose to increase verbosity.
+        """
+        super().__init__(log, logfile, init_atten=init_atten)
+
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._request_lock = asyncio.Lock()
+
+    # --- Transport
+    async def _read_until_done(self) -> Union[Tuple[bytes, bool], None]:
+        """Read up to and including the next reply terminator from the stream.
+
+        :return: (reply bytes, True if the reply ended with an error code),
+            or None if the connection closed
+        """
+        end = self._reply_end.search(self._rx_buf, 0, self._rx_len)
+        while end is None:
+            chunk = await self._reader.read(65536)
+            if not chunk:
+                self.report_error("Connection closed by controller")
+                return None
+            # Only rescan the tail a split terminator could start in
+            scanned = max(0, self._rx_len - 6)
+            self._rx_buf[self._rx_len:self._rx_len + len(chunk)] = chunk
+            self._rx_len += len(chunk)
+            end = self._reply_end.search(self._rx_buf, scanned, self._rx_len)
+        return self._take_reply(end)
+
+    async def request(self, command: str, *args, custom_command=False,
+                      timeout: float = OZProtocolMixin.reply_timeout_s
+                      ) -> Union[OzResponse, None]:
+        """
+        Send a command and read its parsed reply
+
+        :param command: String, command to send to the stage controller
+        :param *args: List of parameters associated with command
+        :param custom_command: Boolean, if true, command is custom
+        :param timeout: Float, seconds to wait for the reply
+        :return: OzResponse, or None if the command was not sent or timed out
+        """
+        command = self._build_command(command, *args, custom_command=custom_command)
+        if command is None:
+            return None
+        try:
+            cmd_encoded = encode_cmd(command)
+        except UnicodeEncodeError:
+            self.report_error(f"Command is not ASCII: {command}")
+            return None
+
+        async with self._request_lock:
+            if self._debug:
+                self.report_debug(f"Sending command: {command}")
+            try:
+                self._writer.write(cmd_encoded)
+                await self._writer.drain()
+                reply = await asyncio.wait_for(self._read_until_done(), timeout)
+            except asyncio.TimeoutError:
+                msg_data = self._decode(self._rx_buf[:self._rx_len])
+                self._rx_len = 0
+                self.report_error(f"Read from controller timed out: {msg_data}")
+                return None
+            except OSError as ex:
+                self.report_error(f"Command send error: {ex.strerror}")
+                return None
+        if reply is None:
+            return None
+        return self._handle_reply(*reply)
+
+    # --- User-Facing Methods
+    async def connect(self, host, port, con_type: str="tcp") -> None:
+        """ Connect to stage controller.
+
+        :param host: String, for tcp connection, host (name or IP)
+        :param port: Int, for tcp connection, port
+        :param con_type: String, tcp or serial (tcp only supported)
+        """
+        if not self.validate_connection_params((host, port)):
+            self.report_error(f"Invalid connection args: {host}:{port}")
+            self._set_connected(False)
+            return
+        if con_type != "tcp":
+            self.report_error(f"Unknown con_type: {con_type}")
+            self._set_connected(False)
+            return
+        try:
+            self._reader, self._writer = await asyncio.open_connection(host, port)
+        except OSError as ex:
+            self.report_error(f"Connection error: {ex.strerror}")
+            self._set_connected(False)
+            return
+        configure_socket(self._writer.get_extra_info("socket"))
+        self._rx_len = 0
+        self.report_info(f"Connected to {host}:{port}")
+        self._set_connected(True)
+
+    async def disconnect(self):
+        """ Disconnect stage controller. """
+        if not self.is_connected():
+            self.report_warning("Already disconnected from device")
+            return
+        self.report_info("Disconnecting from stage controller")
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+            self.report_info("Disconnected from stage controller")
+        except OSError as ex:
+            self.report_error(f"Disconnection error: {ex.strerror}")
+        self._reader = self._writer = None
+        self._set_connected(False)
+
+    async def initialize(self) -> bool:
+        """ Initialize stage controller. """
+        # No initial attenuation specified, so we assume we are at the required position
+        if self.init_attenuation is None:
+            self.homed = True
+        else:
+            if not await self.home():
+                self.report_error("Failed to initialize controller")
+                return False
+            if not await self.set_attenuation(self.init_attenuation):
+                self.report_error("Failed to set initial attenuation")
+                return False
+        self.initialized = self.homed
+        return self.initialized
+
+    async def home(self) -> bool:
+        """
+        Home the stage
+
+        :return: True if home was successful, False otherwise
+        """
+        if not self.is_homed():
+            self.current_attenuation = None
+            self.current_position = None
+            self._record_home(await self.request('H'))
+        else:
+            self.report_warning("Already homed.")
+
+        return self.homed
+
+    async def get_atomic_value(self, item: str ="") -> Union[float, int, None]:
+        """Return single value for item"""
+        if "pos" in item:
+            getter, name = self.get_pos, "position"
+        elif "atten" in item:
+            getter, name = self.get_attenuation, "attenuation"
+        else:
+            self.report_error(f"Unknown item: {item}, choose pos or atten")
+            return None
+        value = await getter()
+        if value is None:
+            self.report_error(f"Failed to get {name}")
+        return value
+
+    async def set_attenuation(self, atten: float=None) -> bool:
+        """
+        Move stage to input attenuation and return when in position
+
+        :param atten: Float, absolute attenuation in dB (0. - 60.)
+        :return: True if successful, False otherwise
+        """
+        if not self._valid_attenuation(atten):
+            return False
+
+        resp = await self.request("A", atten)
+        if not self._move_started(resp, "Attenuation setting not achieved!"):
+            return False
+        await asyncio.sleep(0.5)
+        return self._value_reached(await self.get_attenuation(), round(atten, 2),
+                                   "Attenuation setting not achieved!")
+
+    async def set_pos(self, pos: int=None) -> bool:
+        """
+        Move stage to absolute position and return when in position
+
+        :param pos: Int, absolute position in steps
+        :return: True if successful, False otherwise
+        """
+        resp = await self.request("S", pos)
+        if not self._move_started(resp, "Position setting not achieved!"):
+            return False
+        await asyncio.sleep(0.5)
+        if not self._value_reached(resp.value, pos, "Position setting not achieved!"):
+            return False
+        await self.get_attenuation()
+        return True
+
+    async def step(self, direction: str ='F') -> Union[int, None]:
+        """
+        Move stage one step and return when in position
+        :param direction: String, 'F' - forward or 'B' - backward
+        :return: Current position in steps or None
+        """
+        direc = self._step_direction(direction)
+        if direc is None:
+            return None
+        return await self._move(direc)
+
+    async def step_many(self, nsteps: int) -> Union[int, None]:
+        """
+        Move stage by a relative number of steps with a single command
+        :param nsteps: Int, steps to move, positive forward or negative backward
+        :return: Current position in steps or None
+        """
+        move = self._step_command(nsteps)
+        if move is None:
+            return None
+        return await self._move(*move)
+
+    async def _move(self, command: str, *args) -> Union[int, None]:
+        """
+        Send a relative move and check the reported position
+
+        :param command: String, F, B, S+ or S-
+        :param *args: Step count for S+ and S-
+        :return: Current position in steps or None
+        """
+        target = self._move_target(command, *args)
+        return self._moved_to(await self.request(command, *args), target)
+
+    async def get_pos(self) -> Union[int, None]:
+        """ Current position
+
+        :return: current position in steps or None
+        """
+        return self._reply_value(await self.request("S?"), ResponseType.POS)
+
+    async def get_attenuation(self) -> Union[float, None]:
+        """ Current attenuation
+
+        :return: current attenuation in dB or None
+        """
+        return self._reply_value(await self.request("A?"), ResponseType.ATTEN)
+
+    async def reset(self) -> Union[str, None]:
+        """ Reset stage
+
+        :return: Configuration string
+        """
+        return self._reply_value(await self.request("RST"), ResponseType.STRING,
+                                 "Failed to reset stage")
+
+    async def get_params(self) -> Union[str, None]:
+        """ Get stage parameters
+
+        :return: Configuration string
+        """
+        params = self._reply_value(await self.request("CD"), ResponseType.STRING,
+                                   "Failed to get stage parameters")
+        if params is not None:
+            self.configuration = params
+        return params
@@ -0,0 +1,520 @@
+# coding=utf-8
+"""
+Code shared by the blocking and asyncio OZ Optics DD-100-MC controllers:
+wire encoding, socket setup, log queueing and reply parsing.
+"""
+import atexit
+import dataclasses
+import enum
+import functools
+import logging
+import logging.handlers
+import queue
+import re
+import socket
+from typing import Union, Dict, Tuple
+
+
+@functools.lru_cache(maxsize=64)
+def encode_cmd(cmd: str) -> bytes:
+    """Return the wire bytes for a controller command."""
+    return cmd.encode('ascii') + b'\r\n'
+
+
+def configure_socket(sock: socket.socket) -> None:
+    """Disable Nagle for the short commands and enable TCP keepalive.
+
+    Terminal servers may drop idle connections silently; keepalive probes
+    after 30 s idle detect that within about a minute instead of at the
+    next command.
+    """
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for option, value in (("TCP_KEEPIDLE", 30), ("TCP_KEEPINTVL", 10), ("TCP_KEEPCNT", 3)):
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+
+# Reply fields and their values, found in one pass over the reply
+_reply_field_re = re.compile(rb'(Pos:|Atten:|ATTEN:|Diff=)\s*([^\s(]*)')
+
+
+@functools.lru_cache(maxsize=256)
+def _reply_fields(raw: bytes) -> Tuple[Tuple[bytes, bytes], ...]:
+    """Return the (field, value) pairs in a reply; polled replies repeat, so cache them."""
+    return tuple(_reply_field_re.findall(raw))
+
+
+def queue_log_handlers(logger: logging.Logger) -> None:
+    """Move the logger's handlers behind a queue serviced by a background thread.
+
+    Loggers are shared by name, so handlers added again by a later controller
+    using the same logfile are duplicates of the queued ones and are dropped.
+    """
+    handlers = [hdlr for hdlr in logger.handlers
+                if not isinstance(hdlr, logging.handlers.QueueHandler)]
+    if not handlers:
+        return
+    for hdlr in handlers:
+        logger.removeHandler(hdlr)
+    # A queue is already in place, so these are duplicates
+    if logger.handlers:
+        for hdlr in handlers:
+            hdlr.close()
+        return
+    # The logger writes through its own handlers, not the root logger's
+    logger.propagate = False
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers,
+                                              respect_handler_level=True)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener.start()
+    # Flush anything still queued when the interpreter exits
+    atexit.register(listener.stop)
+
+
+class ResponseType(enum.Enum):
+    """Controller response types."""
+    ATTEN = "attenuation"
+    POS = "steps"
+    DIFF = "diff"
+    BOTH = "attenuation and steps"
+    STRING = "string"
+    ERROR = "error"
+
+
+@dataclasses.dataclass
+class OzResponse:
+    """Oz controller response data."""
+    type: ResponseType
+    value: Union[float, int, str, dict, None]
+
+
+class OZProtocolMixin:
+    """
+    Command building and reply parsing for the OZ Optics DD-100-MC protocol.
+
+    Shared by the blocking and asyncio controllers, which both derive from
+    HardwareMotionBase for logging and connection state and list this mixin
+    first so its __init__ sets up the stage state.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    controller_commands = frozenset({
+                           "A",     # Set attenuation
+                           "A?",    # Get attenuation
+                           "B",     # Move attenuator one step backward
+                           "CD",    # Configuration Display
+                           "D",     # Gets current attenuation and step position
+                           "E0",    # In RS232 mode, sets echo to OFF
+                           "E1",    # In RS232 mode, sets echo to ON
+                           "F",     # Move attenuator one step forward
+                           "H",     # Re-homes the unit
+                           "L",     # Insertion loss
+                           "RES?",  # Read previous command response
+                           "RST",   # Restarts in self-test mode
+                           "S?",    # Requests current position of the attenuator
+                           "S",     # Sets the position of the attenuator to <n> steps from home
+                           "S+",    # Adds <n> steps to current position
+                           "S-"     # Subtracts <n> steps from current position
+                           })
+    return_value_commands = frozenset({"A", "A?", "B", "CD", "D", "F", "H", "L",
+                                       "RES?", "RST", "S?", "S", "S+", "S-"})
+    parameter_commands = frozenset({"A", "L", "S", "S+", "S-"})
+    error = {
+        "Done": "No error.",
+        "Error-2": "Bad command.  The command is ignored.",
+        "Error-5": "Home sensor error.  Return unit to factory for repair.",
+        "Error-6": "Overflow.  The command is ignored.",
+        "Error-7": "Motor voltage exceeds safe limits"
+    }
+    # Default wait for a reply, also the blocking controller's socket timeout
+    reply_timeout_s = 30.
+    # A reply ends with Done, or with an error code in place of Done;
+    # one search finds either terminator and says which it was
+    _reply_end = re.compile(rb'(?P<done>Done)|(?P<error>Error-\d)')
+
+    def __init__(self, *args, init_atten: Union[float, None] =None, **kwargs):
+        """
+        Set up logging, stage state and the receive buffer
+
+        :param init_atten: Float, attenuation to set in initialize(), or None
+
+        Other arguments are passed on to HardwareMotionBase.
+        """
+        super().__init__(*args, **kwargs)
+
+        # Keep file and console writes off the command path
+        if isinstance(getattr(self, "logger", None), logging.Logger):
+            queue_log_handlers(self.logger)
+
+        # Cached debug-level check, refreshed by set_verbose
+        self._debug = self._debug_enabled()
+
+        self.current_attenuation = None
+        self.init_attenuation = init_atten
+        self.current_position = None
+        self.current_diff = None
+        self.configuration = ""
+        self.homed = False
+        self.last_error = ""
+
+        # Receive buffer, filled in place as data arrives; the first _rx_len
+        # bytes have been received but not yet consumed as a reply
+        self._rx_buf = bytearray(8192)
+        self._rx_len = 0
+
+    def set_verbose(self, *args, **kwargs):
+        """ Set logging verbosity and refresh the cached debug check. """
+        super().set_verbose(*args, **kwargs)
+        self._debug = self._debug_enabled()
+
+    def is_homed(self) -> bool:
+        """ Has the stage controller been homed?"""
+        return self.homed
+
+    def _debug_enabled(self) -> bool:
+        """ Is debug-level logging enabled? Assume so if there is no logger to ask. """
+        logger = getattr(self, "logger", None)
+        return logger is None or logger.isEnabledFor(logging.DEBUG)
+
+    def _take_reply(self, end: re.Match) -> Tuple[bytes, bool]:
+        """Remove the reply ending at a terminator match from the receive buffer.
+
+        :param end: Match of _reply_end in the receive buffer
+        :return: (reply bytes, True if the reply ended with an error code)
+        """
+        is_error = end.lastgroup == 'error'
+        # Move any following bytes to the front for the next reply
+        recv = bytes(self._rx_buf[:end.end()])
+        remaining = self._rx_len - end.end()
+        self._rx_buf[:remaining] = self._rx_buf[end.end():self._rx_len]
+        self._rx_len = remaining
+        return recv, is_error
+
+    def _handle_reply(self, recv: bytes, is_error: bool) -> OzResponse:
+        """Parse a framed reply, reporting controller errors.
+
+        :param recv: Bytes, reply up to and including its terminator
+        :param is_error: Boolean, True if the reply ended with an error code
+        """
+        if is_error:
+            msg_data = self._decode(recv)
+            self.report_error(msg_data)
+            error_string = self._return_parse_error(msg_data)
+            return OzResponse(ResponseType.ERROR, error_string)
+
+        if self._debug:
+            recv_len = len(recv)
+            self.report_debug(f"Return: len = {recv_len}, Value = {recv}")
+
+        resp = self._parse_response(recv)
+        if resp.type == ResponseType.ERROR:
+            self.report_error(resp.value)
+
+        return resp
+
+    @staticmethod
+    def _decode(raw: bytes) -> str:
+        """Decode controller bytes to a string.
+
+        The protocol is ASCII; latin-1 is the cheapest codec that cannot fail.
+        """
+        return raw.decode('latin-1')
+
+    def _parse_response(self, raw: bytes) -> OzResponse:
+        """Parse the response from stage controller.
+
+        Numeric fields are converted straight from bytes; only string and
+        error replies are decoded.
+        """
+        # pylint: disable=too-many-branches,too-many-statements
+        raw = raw.strip()
+
+        # One regex pass picks out every field; the first occurrence of a label wins
+        fields = dict(reversed(_reply_fields(raw)))
+
+        pos = None
+        pos_read = False
+        if b'Pos:' in fields:
+            try:
+                pos = int(fields[b'Pos:'])
+                self.current_position = pos
+                pos_read = True
+            except ValueError:
+                self.report_error("Error parsing position")
+
+        atten = None
+        atten_read = False
+        atten_field = fields.get(b'Atten:', fields.get(b'ATTEN:'))
+        if atten_field is not None:
+            try:
+                if b'unknown' not in raw:
+                    atten = float(atten_field)
+                self.current_attenuation = atten
+                atten_read = True
+            except ValueError:
+                self.report_error("Error parsing attenuation")
+
+        # Diff (after homing)
+        diff = None
+        diff_read = False
+        if b'Diff=' in fields:
+            try:
+                diff = float(fields[b'Diff='])
+                self.current_diff = diff
+                self.current_position = 0
+                diff_read = True
+            except ValueError:
+                self.report_error("Error parsing diff")
+
+        # Error cases
+        if b'Error' in raw or self.status < 0:
+            error_string = self._decode(raw) if self.status >= 0 else self.status_string
+            return OzResponse(ResponseType.ERROR, error_string)
+
+        # Both Attenuation and Steps
+        if pos_read and atten_read:
+            return OzResponse(ResponseType.BOTH, {"pos": pos, "atten": atten})
+
+        # Attenuation
+        if atten_read:
+            return OzResponse(ResponseType.ATTEN, atten)
+
+        # Pos
+        if pos_read:
+            return OzResponse(ResponseType.POS, pos)
+
+        # Diff (after homing)
+        if diff_read:
+            return OzResponse(ResponseType.DIFF, diff)
+
+        # Default to string
+        return OzResponse(ResponseType.STRING, self._decode(raw))
+
+    def _build_command(self, command: str, *args, custom_command=False) -> Union[str, None]:
+        """
+        Verify a command and append its parameters
+
+        :param command: String, command to send to the stage controller
+        :param *args: List of string parameters associated with cmd
+        :param custom_command: Boolean, if true, command is custom
+        :return: String, command ready to send, or None if invalid
+        """
+
+        # verify cmd and stage_id, keeping the normalized form for the checks below
+        command = self._verify_send_command(command, custom_command)
+        if command is None:
+            return None
+
+        # Check if the command should have parameters
+        if command in self.parameter_commands and args:
+            if self._debug:
+                self.report_debug("Adding parameters")
+            if len(args) == 1:
+                # Attenuation and loss take two decimals, positions are steps
+                try:
+                    if command in ("A", "L"):
+                        command = f"{command}{float(args[0]):.2f}"
+                    else:
+                        command = f"{command}{int(args[0])}"
+                except (TypeError, ValueError):
+                    self.report_error(f"Invalid parameter for {command}: {args[0]}")
+                    return None
+            else:
+                command += "".join(map(str, args))
+
+        if self._debug:
+            self.report_debug(f"Input command: {command}")
+        return command
+
+    def _verify_send_command(self, cmd, custom_command=False) -> Union[str, None]:
+        """ Verify cmd and stage_id
+
+        :param cmd: String, command to send to the stage controller
+        :param custom_command: Boolean, if true, command is custom
+        :return: String, upper-cased command (custom commands unchanged), or None if invalid"""
+
+        # Do we have a connection?
+        if not self.is_connected():
+            self.report_error('Not connected to controller')
+            return None
+
+        # Do we have a legal command?
+        normalized = cmd.rstrip()
+        if not normalized.isupper():
+            normalized = normalized.upper()
+        if normalized in self.controller_commands:
+            if self._debug:
+                self.report_debug(f"{cmd} is a valid command")
+            return normalized
+        if not custom_command:
+            self.report_error(f"{cmd} is not a valid command")
+            return None
+        self.report_info(f"{cmd} is a custom command")
+        return cmd
+
+    def _reply_value(self, resp: Union[OzResponse, None], expected: ResponseType,
+                     failure: str = "") -> Union[float, int, str, dict, None]:
+        """
+        Return the value of a reply of the expected type
+
+        :param resp: OzResponse, or None if no reply was read
+        :param expected: ResponseType the command replies with
+        :param failure: String, error to report when there was no reply
+        :return: reply value, or None after reporting a controller error
+        """
+        if resp is None:
+            if failure:
+                self.report_error(failure)
+            return None
+        if resp.type == expected:
+            if self._debug:
+                self.report_debug(f"{resp.value}")
+            return resp.value
+        if resp.type == ResponseType.ERROR:
+            self.report_error(f"{resp.value}")
+        return None
+
+    def _valid_attenuation(self, atten: Union[float, None]) -> bool:
+        """
+        Check an attenuation is within the controller's range
+
+        :param atten: Float, absolute attenuation in dB (0. - 60.)
+        :return: True if valid, False after reporting otherwise
+        """
+        if atten is None or atten < 0.0 or atten > 60.0:
+            self.report_error(f"Invalid attenuation: {atten}, cannot be < 0. or > 60.")
+            return False
+        return True
+
+    def _move_started(self, resp: Union[OzResponse, None], failure: str) -> bool:
+        """
+        Check that the controller accepted a move
+
+        :param resp: OzResponse, or None if no reply was read
+        :param failure: String, error to report when the stage did not move
+        :return: True if the reply reports a position, False otherwise
+        """
+        if resp is not None and resp.type == ResponseType.POS:
+            return True
+        if resp is not None and resp.type == ResponseType.ERROR:
+            self.report_error(f"{resp.value}")
+        else:
+            self.report_error(failure)
+        return False
+
+    def _value_reached(self, value: Union[float, int, None], target: Union[float, int],
+                       failure: str) -> bool:
+        """
+        Check that a move ended at its target
+
+        :param value: Value read back after the move
+        :param target: Value the move was to reach
+        :param failure: String, error to report when the target was missed
+        :return: True if value equals target, False otherwise
+        """
+        if self._debug:
+            self.report_debug(f"{value}")
+        if value != target:
+            self.report_error(failure)
+            return False
+        return True
+
+    def _record_home(self, resp: Union[OzResponse, None]):
+        """
+        Update the homed state from the reply to a home command
+
+        :param resp: OzResponse, or None if no reply was read
+        """
+        if resp is None:
+            return
+        if resp.type == ResponseType.DIFF:
+            self.homed = True
+            if self._debug:
+                self.report_debug(f"{resp.value}")
+        elif resp.type == ResponseType.ERROR:
+            self.report_error(f"{resp.value}")
+
+    def _step_direction(self, direction: str) -> Union[str, None]:
+        """
+        Check a single step direction
+
+        :param direction: String, 'F' - forward or 'B' - backward
+        :return: F or B, or None if direction is invalid
+        """
+        direc = direction.upper()
+        if direc not in ['F', 'B']:
+            self.report_error("Invalid direction: use F or B")
+            return None
+        return direc
+
+    def _step_command(self, nsteps: int) -> Union[Tuple[str, int], None]:
+        """
+        Build the single relative move for a number of steps
+
+        :param nsteps: Int, steps to move, positive forward or negative backward
+        :return: (S+ or S-, step count), or None if nsteps is not a number
+        """
+        try:
+            nsteps = int(nsteps)
+        except (TypeError, ValueError):
+            self.report_error(f"Invalid number of steps: {nsteps}")
+            return None
+        return ("S+" if nsteps >= 0 else "S-"), abs(nsteps)
+
+    def _move_target(self, command: str, *args) -> Union[int, None]:
+        """
+        Position a relative move should end at
+
+        :param command: String, F, B, S+ or S-
+        :param *args: Step count for S+ and S-
+        :return: target position in steps, or None if the position is unknown
+        """
+        if self.current_position is None:
+            return None
+        steps = args[0] if args else 1
+        if command in ("B", "S-"):
+            steps = -steps
+        return self.current_position + steps
+
+    def _moved_to(self, resp: Union[OzResponse, None],
+                  target: Union[int, None]) -> Union[int, None]:
+        """
+        Position reported after a relative move
+
+        :param resp: OzResponse, or None if no reply was read
+        :param target: Int, position the move should end at, or None if unknown
+        :return: current position in steps or None
+        """
+        if not self._move_started(resp, "Position setting not achieved!"):
+            return None
+        if target is None:
+            if self._debug:
+                self.report_debug(f"{resp.value}")
+        else:
+            self._value_reached(resp.value, target, "Position setting not achieved!")
+        return resp.value
+
+    def close_loop(self) -> bool:
+        """ Close loop"""
+        return True
+
+    def is_loop_closed(self) -> bool:
+        """ Check if loop is closed"""
+        return True
+
+    def get_limits(self) -> Union[Dict[str, Tuple[float, float]], None]:
+        """ Get stage limits"""
+        return None
+
+    def _return_parse_error(self, error=""):
+        """
+        Parse the return error message from the controller.  The message code is
+        the last whitespace-separated token, e.g. Error-2
+
+        :param error: Error code from the controller
+        :return: String message
+        """
+        tokens = error.split()
+        return self.error.get(tokens[-1] if tokens else "", "Unknown error")
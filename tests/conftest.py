@@ -0,0 +1,20 @@
+"""Shared test fixtures."""
+import socket
+
+import pytest
+
+from dd100mc import OZController
+
+
+@pytest.fixture
+def socket_pair():
+    """Yield a connected controller wired to one end of a socket pair, and the other end."""
+    controller = OZController()
+    controller_end, device = socket.socketpair()
+    controller.socket = controller_end
+    controller._set_connected(True)  # pylint: disable=W0212
+    try:
+        yield controller, device
+    finally:
+        controller_end.close()
+        device.close()
@@ -0,0 +1,114 @@
+"""Tests for the asyncio controller variant."""
+import asyncio
+from dd100mc_async import AsyncOZController
+
+
+def run_with_device(handle, body):
+    """Serve handle on a local port and run body(controller) connected to it."""
+    async def run():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        controller = AsyncOZController(log=False)
+        await controller.connect("127.0.0.1", port)
+        assert controller.is_connected()
+        try:
+            await body(controller)
+        finally:
+            await controller.disconnect()
+            server.close()
+            await server.wait_closed()
+
+    asyncio.run(run())
+
+
+def test_async_request_round_trip():
+    """Replies are framed and parsed on an asyncio stream."""
+    received = []
+
+    async def handle(reader, writer):
+        received.append(await reader.readuntil(b"\r\n"))
+        writer.write(b"Pos:12\r\nDone\r\n")
+        received.append(await reader.readuntil(b"\r\n"))
+        writer.write(b"Error-2\r\n")
+        received.append(await reader.readuntil(b"\r\n"))
+        writer.write(b"Pos:9\r\nDone\r\n")
+        await writer.drain()
+        writer.close()
+
+    async def body(controller):
+        assert await controller.get_pos() == 12
+        assert await controller.get_attenuation() is None
+        assert await controller.step_many(-3) == 9
+
+    run_with_device(handle, body)
+    assert received == [b"S?\r\n", b"A?\r\n", b"S-3\r\n"]
+
+
+def test_async_request_timeout_discards_buffer():
+    """A timed out request drops the partial reply so it cannot prefix the next one."""
+    async def handle(reader, writer):
+        await reader.readuntil(b"\r\n")
+        writer.write(b"Pos:1\r\n")
+        await reader.readuntil(b"\r\n")
+        writer.write(b"Pos:5\r\nDone\r\n")
+        await writer.drain()
+        await reader.read()
+        writer.close()
+
+    async def body(controller):
+        assert await controller.request("S?", timeout=0.1) is None
+        assert controller._rx_len == 0  # pylint: disable=W0212
+        assert await controller.get_pos() == 5
+
+    run_with_device(handle, body)
+
+
+def test_async_peer_close():
+    """A connection closed before the reply ends returns None."""
+    async def handle(reader, writer):
+        await reader.readuntil(b"\r\n")
+        writer.write(b"Pos:1\r\n")
+        await writer.drain()
+        writer.close()
+
+    async def body(controller):
+        assert await controller.get_pos() is None
+
+    run_with_device(handle, body)
+
+
+def test_async_moves():
+    """set_attenuation checks the attenuation read back; step_many sends one command."""
+    received = []
+
+    async def handle(reader, writer):
+        for reply in (b"Pos:100\r\nDone\r\n", b"Atten:12.50\r\nDone\r\n",
+                      b"Pos:103\r\nDone\r\n", b"Pos:101\r\nDone\r\n"):
+            received.append(await reader.readuntil(b"\r\n"))
+            writer.write(reply)
+        await writer.drain()
+        await reader.read()
+        writer.close()
+
+    async def body(controller):
+        assert await controller.set_attenuation(12.5)
+        assert controller.current_attenuation == 12.5
+        assert await controller.step_many(3) == 103
+        assert await controller.step_many("x") is None
+        assert await controller.step_many(-2) == 101
+        assert not await controller.set_attenuation(61.)
+
+    run_with_device(handle, body)
+    assert received == [b"A12.50\r\n", b"A?\r\n", b"S+3\r\n", b"S-2\r\n"]
+
+
+def test_async_connect_invalid_args():
+    """connect leaves the controller disconnected when it cannot connect."""
+    async def run():
+        controller = AsyncOZController(log=False)
+        await controller.connect("127.0.0.1", 8000, con_type="serial")
+        assert not controller.is_connected()
+        await controller.connect("127.0.0.1", 0)
+        assert not controller.is_connected()
+
+    asyncio.run(run())
@@ -1,5 +1,9 @@
 """Perform basic tests."""
-from dd100mc import OZController
+import select
+import threading
+import time
+
+from dd100mc import OZController, ResponseType
 
 def test_initialization():
     """Test initialization."""
@@ -11,3 +15,71 @@ def test_connection_fail():
     controller = OZController()
     controller.connect("127.0.0.1", 50000)
     assert not controller.connected
+    if controller.socket is not None:
+        controller.socket.close()
+
+def test_return_parse_error():
+    """Test error codes are matched on the full trailing token."""
+    # pylint: disable=W0212
+    controller = OZController()
+    assert controller._return_parse_error("Error-5\r\n") == \
+           "Home sensor error.  Return unit to factory for repair."
+    assert controller._return_parse_error("Pos:12\r\nError-6") == \
+           "Overflow.  The command is ignored."
+    assert controller._return_parse_error("Error-X5") == "Unknown error"
+    assert controller._return_parse_error("") == "Unknown error"
+
+def test_read_reply_returns_on_done(socket_pair):
+    """Test a complete reply is returned without waiting out the timeout."""
+    # pylint: disable=W0212
+    controller, device = socket_pair
+    device.sendall(b"Pos:42\r\nDone\r\n")
+    start = time.monotonic()
+    resp = controller._read_reply(timeout=30.)
+    assert time.monotonic() - start < 1.
+    assert resp.value == 42
+
+def test_read_reply_split_terminator(socket_pair):
+    """Test a terminator split across two reads is still found."""
+    # pylint: disable=W0212
+    controller, device = socket_pair
+    device.sendall(b"Pos:42\r\nDo")
+    threading.Timer(0.05, device.sendall, [b"ne\r\nPos:43\r\nDone\r\n"]).start()
+    assert controller._read_reply(timeout=5.).value == 42
+    assert controller._read_reply(timeout=5.).value == 43
+
+def test_parse_response():
+    """Test replies are parsed from bytes."""
+    # pylint: disable=W0212
+    controller = OZController()
+    assert controller._parse_response(b"Pos:1234\r\nDone").value == 1234
+    assert controller._parse_response(b"Atten:12.50(dB)\r\nDone").value == 12.5
+    assert controller._parse_response(b"ATTEN: 3.25\r\nDone").value == 3.25
+    both = controller._parse_response(b"Pos:1 Atten:2.50(dB)\r\nDone")
+    assert both.type == ResponseType.BOTH
+    assert both.value == {"pos": 1, "atten": 2.5}
+    assert controller._parse_response(b"Diff= 1.5\r\nDone").type == ResponseType.DIFF
+    repeated = controller._parse_response(b"Pos:7 Atten:1.00(dB)\r\nPos:8 Atten:2.00(dB)\r\nDone")
+    assert repeated.value == {"pos": 7, "atten": 1.0}
+    assert controller._parse_response(b"Config\r\nDone").value == "Config\r\nDone"
+
+def test_parameter_formatting(socket_pair):
+    """Test attenuation is formatted with two decimals and positions as integers."""
+    # pylint: disable=W0212
+    controller, _ = socket_pair
+    assert controller._build_command("A", 0.1) == "A0.10"
+    assert controller._build_command("S+", 25.0) == "S+25"
+    assert controller._build_command("s", 7) == "S7"
+    assert controller._build_command("S", None) is None
+
+def test_step_many_single_command(socket_pair):
+    """Test a relative move is one S+/S- command, not one command per step."""
+    controller, device = socket_pair
+    controller.current_position = 10
+    device.sendall(b"Pos:13\r\nDone\r\nPos:10\r\nDone\r\n")
+    assert controller.step_many(3) == 13
+    assert device.recv(1024) == b"S+3\r\n"
+    assert controller.step_many(-3) == 10
+    assert device.recv(1024) == b"S-3\r\n"
+    assert controller.step_many("x") is None
+    assert not select.select([device], [], [], 0)[0]
@@ -0,0 +1,54 @@
+"""Test pipelined commands against a local socket pair."""
+import select
+import threading
+
+from dd100mc import ResponseType
+
+
+def test_pipeline_single_write(socket_pair):
+    """Queued commands go out in one write and replies resolve in order."""
+    controller, device = socket_pair
+    device.sendall(b"Pos:1234\r\nDone\r\nAtten:12.50(dB)\r\nDone\r\nError-2\r\n")
+    with controller.pipeline():
+        pos = controller.queue_command("S?")
+        atten = controller.queue_command("A?")
+        bad = controller.queue_command("D")
+    assert device.recv(1024) == b"S?\r\nA?\r\nD\r\n"
+    assert pos.result().value == 1234
+    assert atten.result().value == 12.5
+    assert bad.result().type == ResponseType.ERROR
+    # Pipelined replies do not feed the reply-time average
+    assert controller._resp_ewma == controller.post_send_settle_s  # pylint: disable=W0212
+
+
+def test_pipeline_discarded_on_error(socket_pair):
+    """Nothing queued is sent when the pipeline block raises."""
+    controller, device = socket_pair
+    try:
+        with controller.pipeline():
+            moved = controller.queue_command("A", 30)
+            raise RuntimeError("abandon batch")
+    except RuntimeError:
+        pass
+    assert moved.result() is None
+    assert not select.select([device], [], [], 0)[0]
+
+
+def test_pipeline_is_per_thread(socket_pair):
+    """Another thread's commands bypass a pipeline open in this thread."""
+    controller, device = socket_pair
+    device.sendall(b"Pos:5\r\nDone\r\nPos:6\r\nDone\r\n")
+    result = []
+    with controller.pipeline():
+        queued = controller.queue_command("S?")
+        other = threading.Thread(target=lambda: result.append(controller.get_pos()))
+        other.start()
+        other.join()
+    assert result == [5]
+    assert queued.result().value == 6
+
+
+def test_queue_command_requires_pipeline(socket_pair):
+    """Queueing outside a pipeline is rejected."""
+    controller, _ = socket_pair
+    assert controller.queue_command("S?") is None